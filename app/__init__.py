@@ -10,4 +10,12 @@ def create_app():
     from .bed_generator import bed_generator_bp
     app.register_blueprint(bed_generator_bp, url_prefix='/bed_generator')
 
+    from .bed_generator.utils import migrate_transcript_sequences
+
+    @app.cli.command('migrate-sequences')
+    def migrate_sequences():
+        """Move transcript sequences out of the transcripts table."""
+        if not migrate_transcript_sequences():
+            print("transcript.db is already up to date.")
+
     return app
\ No newline at end of file
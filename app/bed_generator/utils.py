@@ -4,9 +4,64 @@ import datetime
 import os
 import json
 import re
+import zlib
+import hashlib
+
+DB_PATH = 'transcript.db'
+
+# Legacy inline sequence columns and the checksum columns that replace them
+SEQUENCE_COLUMNS = {
+    'sequence': 'sequence_checksum',
+    'three_prime_utr_seq': 'three_prime_utr_seq_checksum',
+    'five_prime_utr_seq': 'five_prime_utr_seq_checksum',
+}
+
+TRANSCRIPTS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        transcript_id TEXT PRIMARY KEY,
+        stable_id TEXT NOT NULL,
+        stable_id_version INTEGER,
+        assembly TEXT,
+        loc_start INTEGER,
+        loc_end INTEGER,
+        loc_strand INTEGER,
+        loc_region TEXT,
+        loc_checksum TEXT,
+        transcript_checksum TEXT,
+        biotype TEXT,
+        sequence_checksum TEXT,
+        gene_id TEXT,
+        three_prime_utr_start INTEGER,
+        three_prime_utr_end INTEGER,
+        three_prime_utr_seq_checksum TEXT,
+        three_prime_utr_checksum TEXT,
+        five_prime_utr_start INTEGER,
+        five_prime_utr_end INTEGER,
+        five_prime_utr_seq_checksum TEXT,
+        five_prime_utr_checksum TEXT,
+        mane_transcript TEXT,
+        mane_transcript_type TEXT,
+        FOREIGN KEY(gene_id) REFERENCES genes(gene_id)
+    );
+'''
+
+# Sequences are stored compressed and keyed by their SHA-1 so the
+# transcripts table only holds compact coordinate rows
+TRANSCRIPT_SEQUENCES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS transcript_sequences (
+        checksum TEXT PRIMARY KEY,
+        sequence BLOB NOT NULL
+    );
+'''
 
 def connect_db():
-    conn = sqlite3.connect('transcript.db')
+    conn = sqlite3.connect(DB_PATH)
+    if has_inline_sequences(conn):
+        conn.close()
+        raise RuntimeError(
+            f"{DB_PATH} stores transcript sequences inline; "
+            "run 'flask --app run migrate-sequences' before starting the app."
+        )
     cursor = conn.cursor()
     # Create tables if they do not exist
     cursor.execute('''
@@ -24,34 +79,8 @@ def connect_db():
             gene_checksum TEXT
         );
     ''')
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transcripts (
-            transcript_id TEXT PRIMARY KEY,
-            stable_id TEXT NOT NULL,
-            stable_id_version INTEGER,
-            assembly TEXT,
-            loc_start INTEGER,
-            loc_end INTEGER,
-            loc_strand INTEGER,
-            loc_region TEXT,
-            loc_checksum TEXT,
-            transcript_checksum TEXT,
-            biotype TEXT,
-            sequence TEXT,
-            gene_id TEXT,
-            three_prime_utr_start INTEGER,
-            three_prime_utr_end INTEGER,
-            three_prime_utr_seq TEXT,
-            three_prime_utr_checksum TEXT,
-            five_prime_utr_start INTEGER,
-            five_prime_utr_end INTEGER,
-            five_prime_utr_seq TEXT,
-            five_prime_utr_checksum TEXT,
-            mane_transcript TEXT,
-            mane_transcript_type TEXT,
-            FOREIGN KEY(gene_id) REFERENCES genes(gene_id)
-        );
-    ''')
+    cursor.execute(TRANSCRIPTS_TABLE.format(table='transcripts'))
+    cursor.execute(TRANSCRIPT_SEQUENCES_TABLE)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS exons (
             exon_id INTEGER PRIMARY KEY,
@@ -106,6 +135,100 @@ def connect_db():
     conn.commit()
     return conn
 
+def has_inline_sequences(conn):
+    cursor = conn.execute('PRAGMA table_info(transcripts)')
+    return 'sequence' in [row[1] for row in cursor.fetchall()]
+
+def migrate_transcript_sequences(db_path=DB_PATH):
+    # Move inline sequences from a pre-existing transcripts table into
+    # transcript_sequences, then rebuild the table without them.
+    # Run once via 'flask --app run migrate-sequences'; returns False if there was
+    # nothing to migrate
+    conn = sqlite3.connect(db_path, timeout=60)
+    try:
+        return _migrate_transcript_sequences(conn)
+    finally:
+        conn.close()
+
+def _migrate_transcript_sequences(conn):
+    # Take the write lock before checking so a second migration run
+    # cannot copy the same table concurrently
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not has_inline_sequences(conn):
+            conn.rollback()
+            return False
+
+        print("Migrating transcript sequences out of the transcripts table...")
+        cursor = conn.cursor()
+        cursor.execute(TRANSCRIPT_SEQUENCES_TABLE)
+        cursor.execute('DROP TABLE IF EXISTS transcripts_new')
+        cursor.execute(TRANSCRIPTS_TABLE.format(table='transcripts_new'))
+        cursor.execute('PRAGMA table_info(transcripts_new)')
+        new_columns = [row[1] for row in cursor.fetchall()]
+        insert_sql = 'INSERT INTO transcripts_new ({}) VALUES ({});'.format(
+            ', '.join(new_columns), ', '.join('?' for _ in new_columns)
+        )
+
+        rows = conn.cursor()
+        rows.row_factory = sqlite3.Row
+        rows.execute('SELECT * FROM transcripts')
+        for row in rows:
+            values = dict(row)
+            for sequence_column, checksum_column in SEQUENCE_COLUMNS.items():
+                values[checksum_column] = store_sequence(conn, values.get(sequence_column))
+            cursor.execute(insert_sql, [values.get(column) for column in new_columns])
+
+        cursor.execute('DROP TABLE transcripts')
+        cursor.execute('ALTER TABLE transcripts_new RENAME TO transcripts')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    # Reclaim the space freed by the dropped sequences
+    try:
+        conn.execute('VACUUM')
+    except sqlite3.OperationalError as e:
+        print(f"Skipping VACUUM after sequence migration: {e}")
+    return True
+
+def sequence_checksum(sequence):
+    # Empty strings are kept distinct from missing sequences
+    if sequence is None:
+        return None
+    return hashlib.sha1(sequence.encode('utf-8')).hexdigest()
+
+def store_sequence(conn, sequence):
+    # Returns the checksum key for the stored sequence, or None if missing
+    checksum = sequence_checksum(sequence)
+    if checksum is not None:
+        conn.execute('''
+            INSERT OR IGNORE INTO transcript_sequences (checksum, sequence)
+            VALUES (?, ?);
+        ''', (checksum, zlib.compress(sequence.encode('utf-8'))))
+    return checksum
+
+def get_transcript_sequences(conn, transcript_id):
+    # Lazily load the transcript and UTR sequences; not needed for BED generation
+    cursor = conn.cursor()
+    cursor.execute('SELECT {} FROM transcripts WHERE transcript_id = ?'.format(
+        ', '.join(SEQUENCE_COLUMNS.values())
+    ), (transcript_id,))
+    checksums = cursor.fetchone()
+    if not checksums:
+        return None
+
+    sequences = {}
+    for column, checksum in zip(SEQUENCE_COLUMNS, checksums):
+        sequences[column] = None
+        if checksum is not None:
+            cursor.execute('SELECT sequence FROM transcript_sequences WHERE checksum = ?', (checksum,))
+            stored = cursor.fetchone()
+            if stored:
+                sequences[column] = zlib.decompress(stored[0]).decode('utf-8')
+    return sequences
+
 def store_transcript_data(conn, data):
     cursor = conn.cursor()
 
@@ -137,8 +260,8 @@ def store_transcript_data(conn, data):
         # Insert transcript information
         cursor.execute('''
             INSERT OR IGNORE INTO transcripts (
-                transcript_id, stable_id, stable_id_version, assembly, loc_start, loc_end, loc_strand, loc_region, loc_checksum, transcript_checksum, biotype, sequence, gene_id,
-                three_prime_utr_start, three_prime_utr_end, three_prime_utr_seq, three_prime_utr_checksum, five_prime_utr_start, five_prime_utr_end, five_prime_utr_seq, five_prime_utr_checksum,
+                transcript_id, stable_id, stable_id_version, assembly, loc_start, loc_end, loc_strand, loc_region, loc_checksum, transcript_checksum, biotype, sequence_checksum, gene_id,
+                three_prime_utr_start, three_prime_utr_end, three_prime_utr_seq_checksum, three_prime_utr_checksum, five_prime_utr_start, five_prime_utr_end, five_prime_utr_seq_checksum, five_prime_utr_checksum,
                 mane_transcript, mane_transcript_type
             )
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
@@ -154,20 +277,26 @@ def store_transcript_data(conn, data):
             entry['loc_checksum'],
             entry['transcript_checksum'],
             entry['biotype'],
-            entry['sequence'],
+            sequence_checksum(entry['sequence']),
             entry['genes'][0]['stable_id'] + '.' + str(entry['genes'][0]['stable_id_version']) if 'genes' in entry and entry['genes'] else None,
             entry.get('three_prime_utr_start', None),
             entry.get('three_prime_utr_end', None),
-            entry.get('three_prime_utr_seq', None),
+            sequence_checksum(entry.get('three_prime_utr_seq', None)),
             entry.get('three_prime_utr_checksum', None),
             entry.get('five_prime_utr_start', None),
             entry.get('five_prime_utr_end', None),
-            entry.get('five_prime_utr_seq', None),
+            sequence_checksum(entry.get('five_prime_utr_seq', None)),
             entry.get('five_prime_utr_checksum', None),
             entry.get('mane_transcript', None),
             entry.get('mane_transcript_type', None)
         ))
 
+        # Only store sequences for newly inserted transcripts so ignored rows
+        # do not leave unreferenced entries in transcript_sequences
+        if cursor.rowcount == 1:
+            for column in SEQUENCE_COLUMNS:
+                store_sequence(conn, entry.get(column))
+
         # Warning if MANE PLUS CLINICAL is found
         if entry.get('mane_transcript_type') == 'MANE PLUS CLINICAL':
             print(f"Warning: Transcript {transcript_id} has MANE PLUS CLINICAL type.")
@@ -0,0 +1,216 @@
+"""Check the transcript sequence migration against a synthetic legacy database.
+
+Builds a transcript.db with the old schema (sequences stored inline in the
+transcripts table), checks that connect_db() refuses it, runs
+migrate_transcript_sequences() and checks that columns, rows and sequences
+survive, that an interrupted migration can be retried, and that the file
+shrinks. Also times the MANE lookup join used by process_identifiers before
+and after the migration, evicting the database from the OS page cache before
+every lookup where posix_fadvise is available.
+
+Usage: python scripts/check_sequence_migration.py [--transcripts N]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.bed_generator import utils
+
+LEGACY_TRANSCRIPTS_TABLE = '''
+    CREATE TABLE transcripts (
+        transcript_id TEXT PRIMARY KEY,
+        stable_id TEXT NOT NULL,
+        stable_id_version INTEGER,
+        assembly TEXT,
+        loc_start INTEGER,
+        loc_end INTEGER,
+        loc_strand INTEGER,
+        loc_region TEXT,
+        loc_checksum TEXT,
+        transcript_checksum TEXT,
+        biotype TEXT,
+        sequence TEXT,
+        gene_id TEXT,
+        three_prime_utr_start INTEGER,
+        three_prime_utr_end INTEGER,
+        three_prime_utr_seq TEXT,
+        three_prime_utr_checksum TEXT,
+        five_prime_utr_start INTEGER,
+        five_prime_utr_end INTEGER,
+        five_prime_utr_seq TEXT,
+        five_prime_utr_checksum TEXT,
+        mane_transcript TEXT,
+        mane_transcript_type TEXT,
+        FOREIGN KEY(gene_id) REFERENCES genes(gene_id)
+    );
+'''
+
+MANE_LOOKUP = '''
+    SELECT t.transcript_id, t.stable_id, t.stable_id_version
+    FROM transcripts t
+    JOIN genes g ON t.gene_id = g.gene_id
+    WHERE g.stable_id = ? AND t.assembly = ? AND t.mane_transcript_type = 'MANE SELECT'
+    ORDER BY t.stable_id_version DESC
+    LIMIT 1
+'''
+
+
+def build_legacy_db(path, count):
+    # Sequences are random bases, so expected sizes here are pessimistic
+    # compared with real transcripts
+    random.seed(0)
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE genes (
+            gene_id TEXT PRIMARY KEY, stable_id TEXT NOT NULL, stable_id_version INTEGER, assembly TEXT,
+            loc_start INTEGER, loc_end INTEGER, loc_strand INTEGER, loc_region TEXT, loc_checksum TEXT,
+            name TEXT, gene_checksum TEXT
+        );
+    ''')
+    conn.execute(LEGACY_TRANSCRIPTS_TABLE)
+    expected = {}
+    for i in range(count):
+        sequence = ''.join(random.choice('ACGT') for _ in range(random.randint(1000, 5000)))
+        three_prime = sequence[-random.randint(100, 800):]
+        # Every tenth transcript has no 5' UTR and the next one an empty one
+        five_prime = {0: None, 1: ''}.get(i % 10, sequence[:random.randint(50, 300)])
+        transcript_id = f"NM_{i:06d}.1"
+        gene_id = f"ENSG{i:011d}.1"
+        conn.execute('INSERT INTO genes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+            gene_id, f"ENSG{i:011d}", 1, 'GRCh38', i * 10000, i * 10000 + 5000, 1, '1', 'x', f"GENE{i}", 'y'
+        ))
+        conn.execute(
+            'INSERT INTO transcripts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', (
+                transcript_id, f"NM_{i:06d}", 1, 'GRCh38', i * 10000, i * 10000 + 5000, 1, '1', 'x', 'c',
+                'protein_coding', sequence, gene_id, 1, 2, three_prime, 'u', 3, 4, five_prime, 'v',
+                transcript_id, 'MANE SELECT'
+            )
+        )
+        expected[transcript_id] = {
+            'sequence': sequence,
+            'three_prime_utr_seq': three_prime,
+            'five_prime_utr_seq': five_prime,
+        }
+    conn.commit()
+    conn.close()
+    return expected
+
+
+def evict_page_cache(path):
+    # Ask the kernel to drop the file's cached pages so the next read
+    # comes from disk
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def time_lookups(path, count, cold, samples=50):
+    # The join scans transcripts, so rows per page dominate the cost.
+    # Each lookup gets a fresh connection so SQLite's own cache is empty too
+    elapsed = 0.0
+    for i in random.Random(1).sample(range(count), min(count, samples)):
+        if cold:
+            evict_page_cache(path)
+        start = time.perf_counter()
+        conn = sqlite3.connect(path)
+        assert conn.execute(MANE_LOOKUP, (f"ENSG{i:011d}", 'GRCh38')).fetchone()
+        conn.close()
+        elapsed += time.perf_counter() - start
+    return elapsed
+
+
+def interrupted_store_sequence(conn, sequence):
+    raise RuntimeError('simulated failure during migration')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transcripts', type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        expected = build_legacy_db('transcript.db', args.transcripts)
+        shutil.copy('transcript.db', 'legacy.db')
+        conn = sqlite3.connect('transcript.db')
+        legacy_columns = [row[1] for row in conn.execute('PRAGMA table_info(transcripts)')]
+        conn.close()
+        size_before = os.path.getsize('transcript.db')
+
+        # The app must refuse a legacy database rather than migrate it in a request
+        try:
+            utils.connect_db()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError('connect_db() accepted a legacy database')
+
+        # An interrupted migration must leave the legacy table intact and retryable
+        store_sequence = utils.store_sequence
+        utils.store_sequence = interrupted_store_sequence
+        try:
+            utils.migrate_transcript_sequences()
+        except RuntimeError:
+            pass
+        finally:
+            utils.store_sequence = store_sequence
+        conn = sqlite3.connect('transcript.db')
+        assert not conn.execute(
+            "SELECT name FROM sqlite_master WHERE name = 'transcripts_new'"
+        ).fetchone(), 'transcripts_new left behind after failed migration'
+        assert utils.has_inline_sequences(conn), 'legacy table lost after failed migration'
+        conn.close()
+
+        assert utils.migrate_transcript_sequences()
+        assert not utils.migrate_transcript_sequences(), 'second migration run was not a no-op'
+
+        conn = utils.connect_db()
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(transcripts)')]
+        expected_columns = [utils.SEQUENCE_COLUMNS.get(column, column) for column in legacy_columns]
+        assert columns == expected_columns, f"unexpected columns: {columns}"
+        row_count = conn.execute('SELECT COUNT(*) FROM transcripts').fetchone()[0]
+        assert row_count == len(expected), f"expected {len(expected)} rows, found {row_count}"
+        for transcript_id, sequences in expected.items():
+            assert utils.get_transcript_sequences(conn, transcript_id) == sequences, transcript_id
+
+        # Re-storing an existing transcript must not add sequences
+        stored = conn.execute('SELECT COUNT(*) FROM transcript_sequences').fetchone()[0]
+        utils.store_transcript_data(conn, [{
+            'stable_id': 'NM_000000', 'stable_id_version': 1, 'assembly': 'GRCh38', 'loc_start': 0,
+            'loc_end': 1, 'loc_strand': 1, 'loc_region': '1', 'loc_checksum': 'x',
+            'transcript_checksum': 'c', 'biotype': 'protein_coding', 'sequence': 'ACGTTGCA' * 50,
+        }])
+        assert conn.execute('SELECT COUNT(*) FROM transcript_sequences').fetchone()[0] == stored
+        conn.close()
+
+        size_after = os.path.getsize('transcript.db')
+        assert size_after < size_before, f"database grew: {size_before} -> {size_after} bytes"
+
+        cold = hasattr(os, 'posix_fadvise')
+        legacy_time = time_lookups('legacy.db', args.transcripts, cold)
+        migrated_time = time_lookups('transcript.db', args.transcripts, cold)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+    print(f"Transcripts:          {args.transcripts}")
+    print(f"Database size:        {size_before / 1024:.0f} KB -> {size_after / 1024:.0f} KB")
+    cache = 'cold' if cold else 'warm, posix_fadvise unavailable'
+    print(f"50 MANE lookups ({cache}): {legacy_time * 1000:.1f} ms -> {migrated_time * 1000:.1f} ms")
+    print("All migration checks passed.")
+
+
+if __name__ == '__main__':
+    main()